@@ -1,7 +1,12 @@
 import pandas as pd
+import matplotlib
+matplotlib.use('Agg') # Non-interactive backend: charts are only saved to files, never shown
 import matplotlib.pyplot as plt
 import sys # <-- ADD THIS LINE
 
+# Screen resolution; 300 DPI cost ~6x the pixels for no visible gain on a web page.
+CHART_DPI = 120
+
 # --- 1. LOAD DATA ---
 try:
     df = pd.read_csv("sample_data.csv")
@@ -21,17 +26,20 @@ plt.title('Overall Mood Distribution', fontsize=16)
 plt.axis('equal')
 
 pie_chart_filename = 'mood_pie_chart.png'
-plt.savefig(pie_chart_filename, dpi=300)
+plt.savefig(pie_chart_filename, dpi=CHART_DPI)
 print(f"SUCCESS: Pie chart saved as '{pie_chart_filename}'")
 plt.close()
 
 
 # --- 3. CREATE BAR CHART for Daily Mood Trends ---
 print("INFO: Creating daily mood trend bar chart...")
-df['date'] = pd.to_datetime(df['date'])
-df['day'] = df['date'].dt.strftime('%b %d')
+# Explicit format skips inference; cache=True parses each repeated date only once.
+dates = pd.to_datetime(df['date'], format='%d-%m-%Y', cache=True)
 
-daily_counts = df.groupby(['day', 'mood_bucket']).size().unstack(fill_value=0)
+# Crosstab on the dates keeps the days in chronological order; relabel afterwards.
+daily_counts = pd.crosstab(dates, df['mood_bucket'])
+daily_counts.index = daily_counts.index.strftime('%b %d')
+daily_counts.index.name = 'day'
 
 daily_counts.plot(kind='bar', stacked=True, figsize=(10, 6), color=colors)
 plt.title('Daily Mood Trends', fontsize=16)
@@ -42,6 +50,6 @@ plt.legend(title='Mood')
 plt.tight_layout()
 
 bar_chart_filename = 'mood_trend_chart.png'
-plt.savefig(bar_chart_filename, dpi=300)
+plt.savefig(bar_chart_filename, dpi=CHART_DPI)
 print(f"SUCCESS: Bar chart saved as '{bar_chart_filename}'")
 plt.close()
\ No newline at end of file
@@ -1,10 +1,18 @@
 
 # ml_logic.py - Updated Version for Day 3
+import asyncio
 import pandas as pd
 import google.generativeai as genai
 import random
+import functools
+import re
+from collections import OrderedDict
 import os
 import sys
+import sqlite3
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Optional
 import time # NEW: For latency profiling
 from dotenv import load_dotenv
 
@@ -13,6 +21,8 @@ from dotenv import load_dotenv
 # SECURELY load the API key from a .env file
 load_dotenv()
 api_key = os.getenv("GOOGLE_API_KEY")
+# The classifier only needs a one-word answer, so use the smallest Flash model.
+GEMINI_MODEL_NAME = 'gemini-1.5-flash-8b'
 model = None
 
 if not api_key:
@@ -21,20 +31,11 @@ if not api_key:
 else:
     try:
         genai.configure(api_key=api_key)
-        model = genai.GenerativeModel('gemini-1.5-flash-latest')
+        model = genai.GenerativeModel(GEMINI_MODEL_NAME)
         print("Gemini API configured successfully!")
     except Exception as e:
         print(f"Error configuring Gemini API: {e}")
 
-# Load the local datasets
-try:
-    moods_df = pd.read_csv('moods.csv')
-    affirmations_df = pd.read_csv('affirmations.csv', engine='python')
-    print("Local data files loaded successfully!")
-except FileNotFoundError as e:
-    print(f"Error loading data file: {e}")
-    sys.exit()
-
 # --- 2. DATA PROCESSING AND MAPPING ---
 
 mood_bucket_map = {
@@ -56,60 +57,259 @@ mood_to_playlist_map = {
     "Neutral": "https://open.spotify.com/playlist/37i9dQZF1DX8Uebhn9wzrS"
 }
 
-moods_df['mood_bucket'] = moods_df['mood_label'].map(mood_bucket_map).fillna('Neutral')
-full_df = pd.merge(moods_df, affirmations_df, left_on='mood_label', right_on='mood_tag')
-print("Data successfully merged and buckets applied!")
+# NEW: Frozen views of the bucket names, built once for prompts and membership tests.
+MOOD_BUCKETS = tuple(mood_to_playlist_map.keys())
+MOOD_BUCKETS_SET = frozenset(MOOD_BUCKETS)
+_MOOD_BUCKETS_PROMPT = ', '.join(MOOD_BUCKETS)
 
+# NEW: Constrain Gemini to exactly one bucket name so no extra tokens are decoded.
+_CLASSIFICATION_CONFIG = genai.GenerationConfig(
+    max_output_tokens=4,
+    temperature=0.0,
+    response_mime_type="text/x.enum",
+    response_schema={"type": "STRING", "enum": list(MOOD_BUCKETS)}
+)
+
+# NEW: Compiled once at import. Unambiguous mood words are matched locally so
+# those inputs never need a Gemini call.
+_KEYWORD_RE = re.compile(r"\b(" + "|".join(map(re.escape, mood_bucket_map)) + r")\b", re.IGNORECASE)
+
+# NEW: The local datasets are loaded on first use and then kept for the life of
+# the process, so importing this module doesn't pay the CSV parse and merge cost.
+@functools.lru_cache(maxsize=1)
+def _load_full_df() -> pd.DataFrame:
+    try:
+        moods_df = pd.read_csv('moods.csv')
+        affirmations_df = pd.read_csv('affirmations.csv', engine='python')
+        print("Local data files loaded successfully!")
+    except FileNotFoundError as e:
+        print(f"Error loading data file: {e}")
+        sys.exit()
+
+    moods_df['mood_bucket'] = moods_df['mood_label'].map(mood_bucket_map).fillna('Neutral').astype('category')
+    # Both join keys share one categorical dtype, so the merge compares integer codes instead of strings.
+    mood_tag_dtype = pd.CategoricalDtype(sorted(set(moods_df['mood_label']) | set(affirmations_df['mood_tag'])))
+    moods_df['mood_label'] = moods_df['mood_label'].astype(mood_tag_dtype)
+    affirmations_df['mood_tag'] = affirmations_df['mood_tag'].astype(mood_tag_dtype)
+    full_df = pd.merge(moods_df, affirmations_df, left_on='mood_label', right_on='mood_tag')
+    print("Data successfully merged and buckets applied!")
+    return full_df
+
+# NEW: full_df is static, so group the (text, safety_flag) pairs per bucket once
+# instead of filtering the DataFrame on every request.
+@functools.lru_cache(maxsize=1)
+def _get_affirmations_by_bucket() -> dict:
+    full_df = _load_full_df()
+    return {
+        bucket: list(zip(group['text'].tolist(), group['safety_flag'].tolist()))
+        for bucket, group in full_df.groupby('mood_bucket', observed=True)
+    }
 
 # --- 3. CORE AI AND LOGIC FUNCTIONS ---
 
+# Risk keywords compiled into one case-insensitive pattern so each check is a single scan.
+risk_keywords = ["suicide", "kill myself", "hurt myself", "end my life", "hopeless"]
+_RISK_RE = re.compile("|".join(map(re.escape, risk_keywords)), re.IGNORECASE)
+
 # NEW (Day 3): Safety check function
 def detect_risk(user_text: str) -> str:
     """
     Uses a keyword list to perform a simple risk assessment.
     Returns 'high' if a risk keyword is found, otherwise 'low'.
     """
-    risk_keywords = ["suicide", "kill myself", "hurt myself", "end my life", "hopeless"]
-    for keyword in risk_keywords:
-        if keyword in user_text.lower():
-            return "high"
-    return "low"
+    return "high" if _RISK_RE.search(user_text) else "low"
+
+# NEW: Exact-match cache so repeated inputs skip the Gemini round-trip.
+# Keyed on normalized text (stripped, lowercased) but the raw text is what gets
+# sent to Gemini, since case can carry sentiment. Entries depend on the current
+# `model`, so call clear_classification_cache() whenever it is reconfigured.
+CLASSIFICATION_CACHE_SIZE = 4096
+_classification_cache = OrderedDict()
+
+# NEW: Persistent layer under the in-memory cache so classifications survive
+# restarts. Rows are keyed on (normalized text, model name) and expire after a
+# day. Only the mood bucket is stored; high-risk input is caught by detect_risk
+# before classification, so the helpline path always runs.
+CLASSIFICATION_DB_PATH = os.getenv("CLASSIFICATION_CACHE_DB", ".classification_cache.sqlite3")
+CLASSIFICATION_DB_TTL_SECONDS = 86400
+_classification_db = None
+# Guards both cache layers, since classify_many calls in from worker threads.
+_classification_cache_lock = threading.Lock()
+
+def _get_classification_db():
+    global _classification_db
+    if _classification_db is None:
+        try:
+            conn = sqlite3.connect(CLASSIFICATION_DB_PATH, check_same_thread=False)
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS classifications ("
+                "cache_key TEXT NOT NULL, model_name TEXT NOT NULL, mood_bucket TEXT NOT NULL, "
+                "created_at REAL NOT NULL, PRIMARY KEY (cache_key, model_name))"
+            )
+            conn.commit()
+            _classification_db = conn
+        except sqlite3.Error as e:
+            print(f"Warning: Classification cache database unavailable: {e}")
+            _classification_db = False
+    return _classification_db or None
+
+def clear_classification_cache() -> None:
+    with _classification_cache_lock:
+        _classification_cache.clear()
+
+def _get_cached_classification(user_text: str):
+    cache_key = user_text.strip().lower()
+    with _classification_cache_lock:
+        mood_bucket = _classification_cache.get(cache_key)
+        if mood_bucket is not None:
+            _classification_cache.move_to_end(cache_key)
+            return mood_bucket
+
+        db = _get_classification_db()
+        if db is None:
+            return None
+        row = db.execute(
+            "SELECT mood_bucket FROM classifications WHERE cache_key = ? AND model_name = ? AND created_at > ?",
+            (cache_key, GEMINI_MODEL_NAME, time.time() - CLASSIFICATION_DB_TTL_SECONDS)
+        ).fetchone()
+        if row is None:
+            return None
+        _classification_cache[cache_key] = row[0]
+        return row[0]
+
+def _store_classification(user_text: str, mood_bucket: str) -> None:
+    cache_key = user_text.strip().lower()
+    with _classification_cache_lock:
+        _classification_cache[cache_key] = mood_bucket
+        if len(_classification_cache) > CLASSIFICATION_CACHE_SIZE:
+            _classification_cache.popitem(last=False)
+
+        db = _get_classification_db()
+        if db is None:
+            return
+        db.execute(
+            "INSERT OR REPLACE INTO classifications VALUES (?, ?, ?, ?)",
+            (cache_key, GEMINI_MODEL_NAME, mood_bucket, time.time())
+        )
+        db.commit()
+
+# The static instructions come first and the user text last, so every request
+# shares the same byte-identical prefix and can hit Gemini's implicit prompt caching.
+_PROMPT_PREFIX = f"""Analyze the sentiment of the following user text. Classify it into ONE of the following categories: {_MOOD_BUCKETS_PROMPT}. Return only the single category name.
+    User Text: \""""
+_PROMPT_SUFFIX = '"\n    Category:'
+
+def _build_classification_prompt(user_text: str) -> str:
+    return _PROMPT_PREFIX + user_text + _PROMPT_SUFFIX
+
+def _parse_mood_bucket(response_text: str) -> str:
+    # The enum response schema means the text is exactly one bucket name.
+    detected_bucket = response_text.strip()
+    return detected_bucket if detected_bucket in MOOD_BUCKETS_SET else "Neutral"
+
+def _match_mood_keyword(user_text: str) -> Optional[str]:
+    match = _KEYWORD_RE.search(user_text)
+    if match:
+        return mood_bucket_map[match.group(1).lower()]
+    return None
+
+# Raises on API errors so that failures are never cached.
+def _classify_text(user_text: str) -> str:
+    prompt = _build_classification_prompt(user_text)
+
+    # MODIFIED (Day 3): Added latency profiling
+    start_time = time.time()
+    response = model.generate_content(prompt, generation_config=_CLASSIFICATION_CONFIG)
+    end_time = time.time()
+    print(f"DEBUG: Gemini API call took {end_time - start_time:.4f} seconds.")
+
+    return _parse_mood_bucket(response.text)
 
 def classify_mood_with_gemini(user_text: str) -> str:
+    keyword_bucket = _match_mood_keyword(user_text)
+    if keyword_bucket:
+        return keyword_bucket
     if not model:
         print("Warning: Gemini model not available. Falling back to 'Neutral'.")
         return "Neutral"
     if not user_text.strip():
         return "Neutral"
 
-    mood_buckets = list(mood_to_playlist_map.keys())
-    prompt = f"""Analyze the sentiment of the following user text. Classify it into ONE of the following categories: {', '.join(mood_buckets)}. Return only the single category name.
-    User Text: "{user_text}"
-    Category:"""
+    cached_bucket = _get_cached_classification(user_text)
+    if cached_bucket is not None:
+        return cached_bucket
+
+    try:
+        mood_bucket = _classify_text(user_text)
+    except Exception as e:
+        print(f"An error with Gemini API: {e}")
+        return "Neutral"
+    _store_classification(user_text, mood_bucket)
+    return mood_bucket
+
+# NEW: Async variant so a backend serving many users can overlap Gemini calls.
+# Shares the classification cache with the synchronous path.
+async def classify_mood_with_gemini_async(user_text: str) -> str:
+    keyword_bucket = _match_mood_keyword(user_text)
+    if keyword_bucket:
+        return keyword_bucket
+    if not model:
+        print("Warning: Gemini model not available. Falling back to 'Neutral'.")
+        return "Neutral"
+    if not user_text.strip():
+        return "Neutral"
+
+    cached_bucket = _get_cached_classification(user_text)
+    if cached_bucket is not None:
+        return cached_bucket
 
     try:
-        # MODIFIED (Day 3): Added latency profiling
         start_time = time.time()
-        response = model.generate_content(prompt)
+        response = await model.generate_content_async(
+            _build_classification_prompt(user_text), generation_config=_CLASSIFICATION_CONFIG
+        )
         end_time = time.time()
-        print(f"DEBUG: Gemini API call took {end_time - start_time:.4f} seconds.")
-
-        detected_bucket = response.text.strip()
-        if detected_bucket in mood_buckets:
-            return detected_bucket
-        else:
-            for bucket in mood_buckets:
-                if bucket in detected_bucket:
-                    return bucket
-            return "Neutral"
+        print(f"DEBUG: Async Gemini API call took {end_time - start_time:.4f} seconds.")
+        mood_bucket = _parse_mood_bucket(response.text)
     except Exception as e:
         print(f"An error with Gemini API: {e}")
         return "Neutral"
+    _store_classification(user_text, mood_bucket)
+    return mood_bucket
+
+# NEW: Classifies a batch of check-ins concurrently. Texts that normalize to the
+# same cache key are only sent to Gemini once. Results keep the input order.
+async def classify_batch(texts: list) -> list:
+    unique_texts = {}
+    for text in texts:
+        unique_texts.setdefault(text.strip().lower(), text)
+    buckets = await asyncio.gather(*[classify_mood_with_gemini_async(t) for t in unique_texts.values()])
+    bucket_by_key = dict(zip(unique_texts.keys(), buckets))
+    return [bucket_by_key[text.strip().lower()] for text in texts]
+
+# NEW: Thread-pool variant of classify_batch for synchronous callers (e.g. offline
+# backfills of historical check-ins). Gemini calls are IO-bound, so threads are
+# enough; all workers share the one configured model and the classification cache.
+def classify_many(texts: list, workers: int = 16) -> list:
+    unique_texts = {}
+    for text in texts:
+        unique_texts.setdefault(text.strip().lower(), text)
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        buckets = list(executor.map(classify_mood_with_gemini, unique_texts.values()))
+    bucket_by_key = dict(zip(unique_texts.keys(), buckets))
+    return [bucket_by_key[text.strip().lower()] for text in texts]
+
+# A caller-supplied mood_bucket must be one of the keys of mood_to_playlist_map.
+def _validate_mood_bucket(mood_bucket: str) -> None:
+    if mood_bucket not in MOOD_BUCKETS_SET:
+        raise ValueError(f"Unknown mood bucket '{mood_bucket}'. Expected one of: {_MOOD_BUCKETS_PROMPT}.")
 
 # MODIFIED (Day 3): Updated to include risk detection
-def get_affirmation_for_text(user_text: str) -> dict:
-    # First, perform risk detection.
-    risk_level = detect_risk(user_text)
+def get_affirmation_for_text(user_text: str, mood_bucket: Optional[str] = None,
+                             risk_level: Optional[str] = None) -> dict:
+    # First, perform risk detection (unless the caller already did).
+    if risk_level is None:
+        risk_level = detect_risk(user_text)
 
     # If risk is high, return a special helpline response immediately.
     if risk_level == 'high':
@@ -123,13 +323,15 @@ def get_affirmation_for_text(user_text: str) -> dict:
         }
     
     # If risk is low, proceed with normal mood classification.
-    mood_bucket = classify_mood_with_gemini(user_text)
-    possible_affirmations = full_df[full_df['mood_bucket'] == mood_bucket].to_dict('records')
+    # Callers that already classified the text can pass mood_bucket to skip Gemini.
+    if mood_bucket is None:
+        mood_bucket = classify_mood_with_gemini(user_text)
+    else:
+        _validate_mood_bucket(mood_bucket)
+    possible_affirmations = _get_affirmations_by_bucket().get(mood_bucket)
 
     if possible_affirmations:
-        selected_affirmation = random.choice(possible_affirmations)
-        affirmation_text = selected_affirmation['text']
-        safety_flag = selected_affirmation['safety_flag']
+        affirmation_text, safety_flag = random.choice(possible_affirmations)
         return {
             "mood_bucket": mood_bucket,
             "affirmation": affirmation_text.strip(),
@@ -142,14 +344,33 @@ def get_affirmation_for_text(user_text: str) -> dict:
             "safety_flag": "safe"
         }
 
-def get_music_recommendation(user_text: str) -> dict:
-    mood_bucket = classify_mood_with_gemini(user_text)
+def get_music_recommendation(user_text: str, mood_bucket: Optional[str] = None) -> dict:
+    if mood_bucket is None:
+        mood_bucket = classify_mood_with_gemini(user_text)
+    else:
+        _validate_mood_bucket(mood_bucket)
     playlist_url = mood_to_playlist_map.get(mood_bucket, mood_to_playlist_map["Neutral"])
     return {
         "mood": mood_bucket,
         "playlist_url": playlist_url
     }
 
+# NEW: Combined check-in endpoint logic. Classifies the text once and reuses
+# the bucket for both the affirmation and the playlist.
+def analyze(user_text: str) -> dict:
+    # High-risk input goes straight to the helpline path without a Gemini call.
+    risk_level = detect_risk(user_text)
+    if risk_level == 'high':
+        mood_bucket = "Urgent"
+    else:
+        mood_bucket = classify_mood_with_gemini(user_text)
+    affirmation = get_affirmation_for_text(user_text, mood_bucket=mood_bucket, risk_level=risk_level)
+    return {
+        "mood_bucket": mood_bucket,
+        "affirmation": affirmation,
+        "music": get_music_recommendation(user_text, mood_bucket=mood_bucket)
+    }
+
 # NEW (Day 3): Trend visualization endpoint logic
 def get_mood_trends(userId: str, period: str) -> dict:
     # This function uses FAKE data. Member 2 (Backend) will help connect this to the real database.
@@ -161,12 +382,11 @@ def get_mood_trends(userId: str, period: str) -> dict:
     ]
     trends_df = pd.DataFrame(fake_check_ins)
     trends_df['date'] = pd.to_datetime(trends_df['date'])
-    daily_counts = trends_df.groupby([trends_df['date'].dt.date, 'mood_bucket']).size().unstack(fill_value=0)
-    
+    # Crosstab on the date (not the formatted label) keeps the days in chronological order.
+    daily_counts = pd.crosstab(trends_df['date'].dt.date, trends_df['mood_bucket'])
+
     labels = [date.strftime('%b %d') for date in daily_counts.index]
-    datasets = []
-    for mood in daily_counts.columns:
-        datasets.append({"label": mood, "data": daily_counts[mood].tolist()})
+    datasets = [{"label": mood, "data": data} for mood, data in daily_counts.to_dict(orient='list').items()]
         
     return {
       "userId": userId, "period": period,
@@ -183,12 +403,12 @@ if __name__ == "__main__":
     # Test 1: Normal, safe input
     test_text_1 = "I am feeling pretty good about my presentation today."
     print(f"\nInput: '{test_text_1}'")
-    print("Affirmation Result:", get_affirmation_for_text(test_text_1))
+    print("Analysis Result:", analyze(test_text_1))
 
     # Test 2: High-risk input
     test_text_2 = "I feel hopeless and want to hurt myself."
     print(f"\nInput: '{test_text_2}'")
-    print("Affirmation Result:", get_affirmation_for_text(test_text_2))
+    print("Analysis Result:", analyze(test_text_2))
     
     # Test 3: Mood trends endpoint
     print("\n--- Testing Mood Trends Endpoint ---")